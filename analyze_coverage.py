@@ -1,6 +1,7 @@
-import time
 import util
 import argparse
+import heapq
+import operator
 from chessgraph import Graph
 import pathlib
 import chess
@@ -24,6 +25,11 @@ def main():
     )
     parser.add_argument('--output_fen_only', action='store_true',
                         help='Flag to only put a list of FENs in the output without any other information')
+    parser.add_argument('--top', type=positive_int,
+                        help="Only put the TOP most likely positions in the output. TOP has to be positive.")
+    parser.add_argument('--cache_file', type=str, default="lichess_explorer_cache",
+                        help="File in which responses of the lichess explorer API are cached, so that subsequent "
+                             "runs do not have to query the API again. Pass an empty string to disable the cache.")
 
     args = parser.parse_args()
     color = args.color
@@ -32,7 +38,7 @@ def main():
     if args.starting_pos is not None and len(args.starting_pos) > 0:
         starting_position = util.relevant_fen_part(args.starting_pos)
     else:
-        starting_position = util.relevant_fen_part(chess.STARTING_FEN)
+        starting_position = util.INITIAL_FEN
 
     if args.color == 'b':
         path = pathlib.Path("data/black")
@@ -45,12 +51,20 @@ def main():
         print("The specified starting fen is not part of the opening tree.")
         return
 
-    api_service = LichessExplorerService(database=database)
+    api_service = LichessExplorerService(database=database, cache_path=args.cache_file)
     position_probabilities = {}
 
-    count_explored_positions = initialize_explored_positions(position_probabilities, graph, starting_position)
+    if starting_position == util.INITIAL_FEN:
+        count_explored_positions = len(graph.dict)
+    else:
+        _, count_explored_positions = graph.compute_stats(starting_position)
 
-    populate_probability_data(position_probabilities, api_service, graph, starting_position, count_explored_positions)
+    try:
+        # the origins are only needed for the output if it is not restricted to the fens
+        populate_probability_data(position_probabilities, api_service, graph, starting_position,
+                                  count_explored_positions, with_origins=not output_fen_only)
+    finally:
+        api_service.close()
 
     print(f"Number of positions with probabilities: {len(position_probabilities)}")
 
@@ -63,30 +77,44 @@ def main():
     else:
         pos_string = ""
     filename = "probabilities_" + color + "_" + database + pos_string + datetime_string + ".txt"
-    print_data(position_probabilities, filename, output_fen_only)
+    print_data(position_probabilities, filename, output_fen_only, args.top)
+
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
 
 
 def get_depth_of_position(fen, graph):
-    if fen == util.relevant_fen_part(chess.STARTING_FEN):
+    if fen == util.INITIAL_FEN:
         return 0
     origin = graph.get_first_origin(fen)
     list_of_san_moves = util.build_list_of_san_moves_from_origin_string(origin)
     return len(list_of_san_moves)
 
 
-def print_data(position_probabilities, filename, output_fen_only):
+def print_data(position_probabilities, filename, output_fen_only, top=None):
+    # the origins of unexplored positions that are reached from the same position share their beginnings, so the
+    # translations of the beginnings are cached while printing
+    san_moves_of_uci_line = {}
     with open(filename, "a") as file:
-        sorted_position_probs = sorted(position_probabilities.items(), key=lambda x: x[1]['prob'], reverse=True)
-        for i, keyValuePair in enumerate(sorted_position_probs, start=1):
+        get_prob = operator.itemgetter('prob')
+        if top is not None:
+            sorted_position_probs = heapq.nlargest(top, position_probabilities.values(), key=get_prob)
+        else:
+            sorted_position_probs = sorted(position_probabilities.values(), key=get_prob, reverse=True)
+        for i, prob_entry in enumerate(sorted_position_probs, start=1):
             if output_fen_only:
-                print(keyValuePair[0], file=file)
+                print(prob_entry['fen'], file=file)
             else:
                 print(f"{i}:", file=file)
-                pretty_print_entry(keyValuePair[0], keyValuePair[1], file)
+                pretty_print_entry(prob_entry['fen'], prob_entry, file, san_moves_of_uci_line)
                 print("", file=file)
 
 
-def pretty_print_entry(fen, prob_entry, file):
+def pretty_print_entry(fen, prob_entry, file, san_moves_of_uci_line=None):
     print(fen, file=file)
     print(f"Depth {prob_entry['depth']}", file=file)
     if prob_entry['color'] == 'w':
@@ -102,71 +130,99 @@ def pretty_print_entry(fen, prob_entry, file):
     print(f"Color to move: {color_to_print} {explored_marker}", file=file)
     print(f"Probability: {prob_entry['prob']}", file=file)
     print("Origins:", file=file)
-    for origin_string in prob_entry['origins']:
-        print(origin_string, file=file)
+    for origin in prob_entry['origins']:
+        if prob_entry['explored']:
+            print(origin, file=file)
+        else:
+            print(util.translate_list_of_uci_into_origin_string(origin, san_moves_of_uci_line), file=file)
 
 
-def populate_probability_data(position_probabilities, apiService, graph, starting_pos, count_explored_positions):
+def populate_probability_data(position_probabilities, apiService, graph, starting_pos, count_explored_positions,
+                              with_origins=True):
     curr_idx = 0
-    for curr_fen in graph.breadth_first(starting_pos):
+    # uci moves of a line leading to each position, recorded when the position is reached for the first time
+    # during the BFS, so that the line does not need to be reconstructed from the origins of the position.
+    starting_board = chess.Board(starting_pos)
+    starting_key = util.position_key(starting_board)
+    uci_paths = {starting_key: tuple(get_list_of_uci_moves(starting_pos, graph))}
+    position_probabilities[starting_key] = initialize_data_for_an_explored_position(starting_pos, graph, with_origins)
+    position_probabilities[starting_key]['prob'] = 1
+    for curr_fen, board in graph.breadth_first_with_boards(starting_pos):
         curr_idx += 1
         print(f"Processing position {curr_fen} which is the {curr_idx}th of {count_explored_positions} positions")
-        curr_color = util.fen_to_color(curr_fen)
-        if curr_color == graph.color:
+        curr_key = util.position_key(board)
+        if curr_key not in position_probabilities:
+            # reached through a move of the graph that the explorer does not know about
+            uci_paths[curr_key] = tuple(get_list_of_uci_moves(curr_fen, graph))
+            position_probabilities[curr_key] = initialize_data_for_an_explored_position(curr_fen, graph, with_origins)
+        curr_list_of_uci = uci_paths[curr_key]
+        if board.turn == graph.turn:
             move_from_node = graph.get_moves(curr_fen)[0]
-            next_fen = util.get_next_fen(curr_fen, move_from_node)
-            position_probabilities[next_fen]['prob'] += position_probabilities[curr_fen]['prob']
+            move = graph.get_move(curr_fen, move_from_node, board)
+            board.push(move)
+            next_key = util.position_key(board)
+            if next_key not in position_probabilities:
+                uci_paths[next_key] = curr_list_of_uci + (move.uci(),)
+                next_fen = graph.find_fen(board)
+                position_probabilities[next_key] = initialize_data_for_an_explored_position(
+                    next_fen, graph, with_origins)
+            board.pop()
+            position_probabilities[next_key]['prob'] += position_probabilities[curr_key]['prob']
         else:
-            curr_list_of_uci = get_list_of_uci_moves(curr_fen, graph)
-            time.sleep(1)  # respect rate limit (with sleep for only half a second, rate limit was exceeded)
             move_probs_list = apiService.get_move_probabilities(curr_list_of_uci)
             for move_prob in move_probs_list:
-                next_fen = util.successor_fen(curr_fen, move_prob['uci'])
-                if next_fen not in position_probabilities:
-                    next_color = util.fen_to_color(next_fen)
-                    position_probabilities[next_fen] = initialize_data_for_a_position(next_color, False)
-                position_probabilities[next_fen]['prob'] += position_probabilities[curr_fen]['prob'] * move_prob['prob']
-                if not graph.node_exists(next_fen):
-                    add_origins_for_unexplored_position(curr_fen, next_fen, move_prob['uci'],
-                                                        graph, position_probabilities)
-                    position_probabilities[next_fen]['depth'] = position_probabilities[curr_fen]['depth'] + 1
+                board.push(board.parse_uci(move_prob['uci']))
+                next_key = util.position_key(board)
+                next_fen = graph.find_fen(board)
+                next_is_explored = next_fen is not None
+                if next_key not in position_probabilities:
+                    uci_paths[next_key] = curr_list_of_uci + (move_prob['uci'],)
+                    if next_is_explored:
+                        position_probabilities[next_key] = initialize_data_for_an_explored_position(
+                    next_fen, graph, with_origins)
+                    else:
+                        next_fen = board.epd()
+                        next_color = util.fen_to_color(next_fen)
+                        position_probabilities[next_key] = initialize_data_for_a_position(next_fen, next_color, False)
+                board.pop()
+                position_probabilities[next_key]['prob'] += position_probabilities[curr_key]['prob'] * move_prob['prob']
+                if not next_is_explored:
+                    if with_origins:
+                        add_origins_for_unexplored_position(curr_key, next_key, move_prob['uci'],
+                                                            position_probabilities)
+                    position_probabilities[next_key]['depth'] = position_probabilities[curr_key]['depth'] + 1
 
 
 def get_list_of_uci_moves(curr_fen, graph):
-    if curr_fen == util.relevant_fen_part(chess.STARTING_FEN):
+    if curr_fen == util.INITIAL_FEN:
         return []
     first_origin = graph.get_first_origin(curr_fen)
     curr_list_of_uci = util.translate_origin_string_into_list_of_uci(first_origin)
     return curr_list_of_uci
 
 
-def initialize_explored_positions(position_probabilities, graph, starting_position):
-    count = 0
-    for fen in graph.breadth_first(starting_position):
-        count += 1
-        position_probabilities[fen] = initialize_data_for_a_position(util.fen_to_color(fen), True)
-        position_probabilities[fen]['origins'].extend(graph.get_origins(fen))
-        position_probabilities[fen]['depth'] = get_depth_of_position(fen, graph)
-    position_probabilities[starting_position]['prob'] = 1
-    return count
-
-
-
-
-def add_origins_for_unexplored_position(curr_fen, next_fen, uci_move, graph, position_probabilities):
-    initial_board_position = util.relevant_fen_part(chess.STARTING_FEN)
-    curr_origins = graph.get_origins(curr_fen)
-    if len(curr_origins) == 0 and curr_fen == initial_board_position:
+def add_origins_for_unexplored_position(curr_key, next_key, uci_move, position_probabilities):
+    # the current position is explored, so its origins are origin strings from the graph. The origins of unexplored
+    # positions are tuples of uci moves, which are only translated back into origin strings when they are printed
+    curr_origins = position_probabilities[curr_key]['origins']
+    if len(curr_origins) == 0 and position_probabilities[curr_key]['fen'] == util.INITIAL_FEN:
         curr_origins = [""]
     for origin in curr_origins:
         list_of_uci = util.translate_origin_string_into_list_of_uci(origin)
-        list_of_uci.append(uci_move)
-        new_origin = util.translate_list_of_uci_into_origin_string(list_of_uci)
-        position_probabilities[next_fen]['origins'].append(new_origin)
+        position_probabilities[next_key]['origins'].append(list_of_uci + (uci_move,))
+
+
+def initialize_data_for_a_position(fen, color, explored):
+    return {'fen': fen, 'prob': 0, 'origins': [], 'explored': explored, 'color': color}
 
 
-def initialize_data_for_a_position(color, explored):
-    return {'prob': 0, 'origins': [], 'explored': explored, 'color': color}
+def initialize_data_for_an_explored_position(fen, graph, with_origins=True):
+    data = initialize_data_for_a_position(fen, util.fen_to_color(fen), True)
+    if with_origins:
+        data['origins'] = graph.get_origins(fen)
+    # the depth is the length of the first origin, which may differ from the length of the line found by the BFS
+    data['depth'] = get_depth_of_position(fen, graph)
+    return data
 
 
 if __name__ == "__main__":
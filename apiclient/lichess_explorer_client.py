@@ -1,12 +1,23 @@
+import json
+import shelve
+import time
 import requests
 
 
 class LichessExplorerClient:
-    def __init__(self, database="lichess"):
+    def __init__(self, database="lichess", min_interval=1.0, burst=1, max_retries=3, cache_path=None):
         """
 
         - database (str): Either "lichess" or "master". Which database to use, i.e.
             either lichess games or master games.
+        - min_interval (float): Number of seconds it takes to refill one request token, in order to
+            respect the rate limit of the API.
+        - burst (int): Maximum number of request tokens that can be saved up, i.e. how many requests
+            may be sent in quick succession after a pause.
+        - max_retries (int): How often a request is retried after the API responded with
+            status 429 (too many requests).
+        - cache_path (str): Optional path of a file in which responses are cached between runs.
+            If None, every call of get_stats queries the API.
         - variant (str): The variant of chess to explore. Default is 'standard'.
         - speeds (list of str): List of game speeds, e.g., ["blitz", "rapid"].
         - ratings (list of int): List of rating groups, e.g., [1200, 1600].
@@ -29,6 +40,70 @@ class LichessExplorerClient:
             self.speeds = None
         else:
             raise Exception("Invalid value for database parameter: " + database)
+        # Build query parameters dictionary
+        params = {
+            "variant": self.variant,
+            "speeds": ",".join(self.speeds) if self.speeds else None,
+            "ratings": ",".join(map(str, self.ratings)) if self.ratings else None,
+            "moves": self.moves,
+            "topGames": 0,
+            "recentGames": 0,
+        }
+        # Remove any parameters that are None (not provided)
+        self._base_params = {k: v for k, v in params.items() if v is not None}
+        self.min_interval = min_interval
+        self.burst = burst
+        self.max_retries = max_retries
+        self._tokens = float(burst)
+        self._last_refill_time = time.monotonic()
+        self.cache = shelve.open(cache_path) if cache_path else None
+        # reuse the connection to the API (HTTP keep-alive) instead of opening a new one for every request
+        self.session = requests.Session()
+
+    def close(self):
+        """
+        Close the connection to the API and the response cache, if there is one, so that all cached responses are
+        written to disk.
+        """
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def _refill_tokens(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill_time) / self.min_interval)
+        self._last_refill_time = now
+
+    def wait_for_rate_limit(self):
+        """
+        Take one token from the request bucket, sleeping until one is available if the bucket is empty.
+        The bucket refills at a rate of one token per min_interval seconds, so the time spent waiting
+        for the previous response (and processing it) counts towards the waiting time.
+        """
+        self._refill_tokens()
+        if self._tokens < 1:
+            time.sleep((1 - self._tokens) * self.min_interval)
+            self._refill_tokens()
+        self._tokens -= 1
+
+    def update_rate_limit(self, response):
+        """
+        Adjust the request bucket to the rate limit headers of a response. If the API reports that fewer
+        requests remain in the current window than we have tokens, the bucket is lowered accordingly, so
+        that we wait once the API has no headroom left. The header never refills the bucket, so requests
+        are never sent faster than one per min_interval seconds.
+
+        Parameters:
+        - response (requests.Response): The response of the latest request.
+        """
+        self._refill_tokens()
+        if response.status_code == 429:
+            self._tokens = 0.0
+            return
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None and remaining.isdigit():
+            self._tokens = min(self._tokens, float(remaining))
 
     def get_stats(self, play=None):
         """
@@ -40,25 +115,33 @@ class LichessExplorerClient:
         Returns:
         - dict: JSON response from the Lichess API.
         """
-        # Build query parameters dictionary
-        params = {
-            "variant": self.variant,
-            "play": play,
-            "speeds": ",".join(self.speeds) if self.speeds else None,
-            "ratings": ",".join(map(str, self.ratings)) if self.ratings else None,
-            "moves": self.moves,
-            "topGames": 0,
-            "recentGames": 0,
-        }
+        # Query parameters that are the same for every position were built in __init__
+        params = {**self._base_params, "play": play} if play is not None else self._base_params
 
-        # Remove any parameters that are None (not provided)
-        params = {k: v for k, v in params.items() if v is not None}
+        # Responses for the same query do not change in a relevant way between runs, so answer from the cache
+        # if possible. Cached responses do not count towards the rate limit.
+        cache_key = json.dumps([self.base_url, params], sort_keys=True)
+        if self.cache is not None and cache_key in self.cache:
+            return self.cache[cache_key]
 
         # Make GET request to the API
         try:
-            response = requests.get(self.base_url, params=params)
+            for attempt in range(self.max_retries + 1):
+                self.wait_for_rate_limit()
+                response = self.session.get(self.base_url, params=params)
+                self.update_rate_limit(response)
+                if response.status_code != 429 or attempt == self.max_retries:
+                    break
+                # too many requests: wait as long as the API asks us to (a full minute by default), doubling the
+                # waiting time for every further attempt
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after is not None and retry_after.isdigit() else 60
+                time.sleep(delay * 2 ** attempt)
             response.raise_for_status()  # Raise an error for bad HTTP status
-            return response.json()  # Return response JSON as a dictionary
+            result = response.json()  # Response JSON as a dictionary
+            if self.cache is not None:
+                self.cache[cache_key] = result
+            return result
         except requests.RequestException as e:
             print(f"An error occurred: {e}")
             return None
@@ -3,13 +3,20 @@ from apiclient.lichess_explorer_client import LichessExplorerClient
 
 class LichessExplorerService:
 
-    def __init__(self, database="lichess"):
+    def __init__(self, database="lichess", cache_path=None):
         """
         Parameters:
         - database (str): Either "lichess" or "master". Which database to use, i.e.
             either lichess games or master games.
+        - cache_path (str): Optional path of a file in which API responses are cached between runs.
         """
-        self.api_client = LichessExplorerClient(database=database)
+        self.api_client = LichessExplorerClient(database=database, cache_path=cache_path)
+
+    def close(self):
+        """
+        Release resources held by the API client, i.e. write cached responses to disk.
+        """
+        self.api_client.close()
 
     def get_move_probabilities(self, list_of_uci_moves):
         """
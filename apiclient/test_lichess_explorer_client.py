@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from apiclient.lichess_explorer_client import LichessExplorerClient
+
+
+class FakeClock:
+    """ replaces time.monotonic and time.sleep, so that sleeping advances the clock without actually waiting """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_response(status_code=200, headers=None, json_data=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = json_data if json_data is not None else {"moves": []}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f"status {status_code}")
+    return response
+
+
+class LichessExplorerClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.multiple("apiclient.lichess_explorer_client.time",
+                                      monotonic=self.clock.monotonic, sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_client(self, responses, **kwargs):
+        client = LichessExplorerClient(database="master", **kwargs)
+        self.addCleanup(client.close)
+        client.session = mock.Mock()
+        client.session.get.side_effect = responses
+        return client
+
+    def test_retries_after_429(self):
+        client = self.make_client([make_response(429, {"Retry-After": "5"}),
+                                   make_response(json_data={"white": 1})])
+        result = client.get_stats("d2d4")
+        self.assertEqual(result, {"white": 1})
+        self.assertEqual(client.session.get.call_count, 2)
+        self.assertIn(5.0, self.clock.sleeps)
+
+    def test_gives_up_after_max_retries(self):
+        client = self.make_client([make_response(429), make_response(429)], max_retries=1)
+        self.assertIsNone(client.get_stats("d2d4"))
+        self.assertEqual(client.session.get.call_count, 2)
+        # the default waiting time of 60 seconds is doubled for every further attempt, but not after the last one
+        self.assertIn(60.0, self.clock.sleeps)
+        self.assertNotIn(120.0, self.clock.sleeps)
+
+    def test_remaining_header_lowers_bucket(self):
+        client = self.make_client([make_response(headers={"X-RateLimit-Remaining": "0"}),
+                                   make_response()], burst=3)
+        client.get_stats("d2d4")
+        self.assertEqual(client._tokens, 0.0)
+        client.get_stats("e2e4")
+        self.assertEqual(self.clock.sleeps, [client.min_interval])
+
+    def test_remaining_header_does_not_refill_bucket(self):
+        client = self.make_client([make_response(headers={"X-RateLimit-Remaining": "50"}),
+                                   make_response(headers={"X-RateLimit-Remaining": "49"})], min_interval=2.0)
+        client.get_stats("d2d4")
+        self.assertEqual(client._tokens, 0.0)
+        client.get_stats("e2e4")
+        # the second request still has to wait for a token, no matter how many requests the API has left
+        self.assertEqual(self.clock.sleeps, [2.0])
+
+    def test_cache_answers_repeated_queries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "cache")
+            client = self.make_client([make_response(json_data={"white": 7})], cache_path=cache_path)
+            self.assertEqual(client.get_stats("d2d4"), {"white": 7})
+            self.assertEqual(client.get_stats("d2d4"), {"white": 7})
+            self.assertEqual(client.session.get.call_count, 1)
+            client.close()
+
+            # a new client reads the responses written to disk by the previous one
+            client = self.make_client([], cache_path=cache_path)
+            self.assertEqual(client.get_stats("d2d4"), {"white": 7})
+            client.session.get.assert_not_called()
+            client.close()
+
+    def test_failed_responses_are_not_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "cache")
+            client = self.make_client([make_response(500), make_response(json_data={"white": 3})],
+                                      cache_path=cache_path)
+            self.assertIsNone(client.get_stats("d2d4"))
+            self.assertEqual(client.get_stats("d2d4"), {"white": 3})
+            self.assertEqual(client.session.get.call_count, 2)
+            client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,18 @@
 
+import sys
+import pathlib
 import chess
 import chess.pgn
-import queue
-from util import relevant_fen_part, fen_to_color, get_next_fen
-from util import build_list_of_san_moves_from_origin_string, build_pgn_from_list_of_san_moves
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from util import INITIAL_FEN, relevant_fen_part, get_next_fen, position_key, successor_board
+from util import build_list_of_san_moves_from_origin_string, build_pgn_from_list_of_san_moves, append_move_to_pgn
+from util import read_pgn_files_in_directory
 
 
 class Graph(object):
     """ a directed graph where nodes correspond to board positions and edges correspond to moves """
-    def __init__(self, color, games, verbose=0):
+    def __init__(self, color, games, verbose=0, n_workers=None, max_origins=None):
         """
         Args:
             color: (string) Either "w" or "b". The color for which the graph will represent an opening book.
@@ -19,21 +23,37 @@ class Graph(object):
             an opening tree loaded directly from a pgn using the chess.pgn library. If games is not the empty list, then
             the Graph is initialized with the data from the games.
             verbose: (int) controls the verbosity of the __init__ function. If verbose > 0, information is printed.
+            n_workers: (int) optional parameter. Number of processes used for consuming the games and for
+            saturating the graph. If None, everything is done in the main process.
+            max_origins: (int) optional parameter. If given, find_origins does not follow further lines through a
+            position once it has max_origins origins (the line reaching the position is still added to its origins).
+            This bounds the number of lines that are enumerated for opening books with many transpositions. Origins
+            found directly in the pgn are always kept, so every position still has at least one origin, but a position
+            below a capped position may not have an origin through every position above it. If None, all lines are
+            enumerated.
         """
         self.dict = {}
+        self.fen_by_key = {}  # maps util.position_key of every position in the graph to its fen
+        self.boards = {}  # maps the fen of every position where the opposite color is to move to a chess.Board
+        self.occupancies = set()  # the pairs (squares occupied by white, squares occupied by black) of all positions
         self.color = color
+        self.turn = chess.WHITE if color == "w" else chess.BLACK  # self.color as a chess.Color
+        self.max_origins = max_origins
         if len(games) > 0:
             if verbose > 0:
                 print("consuming pgn data")
-            for game in games:
-                self.consume_pgn_game(game)
-            self.saturate(verbose=verbose)
+            if n_workers is None or n_workers <= 1:
+                for game in games:
+                    self.consume_pgn_game(game)
+            else:
+                self.consume_pgn_games_in_parallel(games, n_workers)
+            self.saturate(verbose=verbose, n_workers=n_workers)
             if verbose > 0:
                 print("finding origins.")
             self.find_origins()
             self.check_all_leaves_are_opponent_color()
 
-    def add_moves(self, fen, move_list):
+    def add_moves(self, fen, move_list, board=None, moves=None):
         """ Add the moves in move_list to the node corrsponding to the board position represented by fen. Create the
         node if it does not exist
 
@@ -42,19 +62,34 @@ class Graph(object):
             first four parts of a FEN, without the move-clocks
             move_list: (list)a list of strings where each one is a chess move in SAN format (Standard Algebraic
             Notation)
+            board: (chess.Board) optional. A board representing the position. Only used when a new node is created,
+            in order to register the position in self.fen_by_key and self.boards without parsing fen. The board is
+            not modified, and add_moves does not keep a reference to it.
+            moves: (list) optional. The moves of move_list as chess.Move objects, in the same order. They are stored
+            in the node, so that traversing the graph does not need to parse the SAN moves again.
 
         Raises: BadOpeningGraphError if after adding the moves, there are more than one moves for the position where
         the player of color self.color is to move.
         """
-        if fen in self.dict:
-            self.dict[fen].add_moves(move_list)
+        node = self.dict.get(fen)
+        if node is not None:
+            node.add_moves(move_list, moves)
         else:
-            self.dict[fen] = Node(move_list)
-
-        if fen_to_color(fen) == self.color and self.dict[fen].out_degree > 1:
+            if board is None:
+                board = chess.Board(fen)
+            elif board.turn != self.turn:
+                # only the boards of opposite-color positions are stored, and those must not share the caller's board
+                board = board.copy(stack=False)
+            node = self.dict[fen] = Node(move_list, board.turn, moves)
+            self.fen_by_key[position_key(board)] = fen
+            self.occupancies.add((board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]))
+            if node.turn != self.turn:
+                self.boards[fen] = board
+
+        if node.turn == self.turn and node.out_degree > 1:
             raise BadOpeningGraphError(f"There is more than one move for position {fen} "
                                        f"in opening book for color {self.color}. Namely there are these:"
-                                       f"{self.dict[fen].explored_moves}")
+                                       f"{node.explored_moves}")
 
     def consume_pgn_game(self, game):
         """
@@ -66,9 +101,54 @@ class Graph(object):
         list_of_sans = []
         self.consume_subtree_of_pgn_game(game, list_of_sans)
 
+    def consume_pgn_games_in_parallel(self, games, n_workers):
+        """
+        Add the data from games to the graph, using a pool of processes. The games are split into n_workers chunks of
+        consecutive games, every process builds a graph from one chunk, and the graphs are merged into self in the
+        order of the chunks. This gives the same graph as consuming the games one after the other.
+
+        Args:
+            games: (list) a list of chess.pgn.Game objects
+            n_workers: (int) the number of processes
+        """
+        chunk_size = -(-len(games) // n_workers)
+        chunks = [games[i:i + chunk_size] for i in range(0, len(games), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for graph in executor.map(build_graph_from_games, [self.color] * len(chunks), chunks):
+                self.merge(graph)
+
+    def merge(self, other):
+        """
+        Add the nodes, moves and origins of other to the graph. Nodes that do not exist in self yet are taken over
+        from other (in the order in which they were created in other), the moves and origins of the other nodes are
+        appended to the existing ones.
+
+        Args:
+            other: (Graph) a graph for the same color. It should not be used anymore afterwards, since its nodes may
+            become part of self.
+        """
+        for key, fen in other.fen_by_key.items():
+            other_node = other.dict[fen]
+            if fen in self.dict:
+                self.add_moves(fen, other_node.explored_moves)
+                node = self.dict[fen]
+                for san, move in other_node.move_by_san.items():
+                    node.move_by_san.setdefault(san, move)
+                for i, origin in enumerate(other_node.origins):
+                    self.add_origin(fen, origin, from_pgn=i < other_node.num_pgn_origins)
+            else:
+                self.dict[fen] = other_node
+                self.fen_by_key[key] = fen
+                if fen in other.boards:
+                    self.boards[fen] = other.boards[fen]
+        self.occupancies |= other.occupancies
+
     def consume_subtree_of_pgn_game(self, game_node, list_of_sans):
         """
-        Add the data from subtree of a pgn game to the graph.
+        Add the data from subtree of a pgn game to the graph. The subtree is traversed depth first (in the same order
+        as the variations appear in the pgn) using an explicit stack of iterators over the variations of the nodes on
+        the current path. Instead of calling game_node.board() for every node, which replays all moves from the root,
+        a single board is kept up to date by pushing a move when descending and popping it when backtracking.
 
         Args:
             game_node: (chess.pgn.GameNode) a node in an opening tree loaded directly from a pgn file
@@ -76,18 +156,38 @@ class Graph(object):
             to get to game_node. The moves are in SAN format
         """
         board = game_node.board()
-        fen = relevant_fen_part(board.fen())
-        move_list = [board.san(child.move) for child in game_node.variations]
-
-        self.add_moves(fen, move_list)
-        if len(list_of_sans) > 0:
-            self.add_origin(fen, build_pgn_from_list_of_san_moves(list_of_sans), from_pgn=True)
-
-        for child in game_node.variations:
-            san = board.san(child.move)
-            list_of_sans.append(san)
-            self.consume_subtree_of_pgn_game(child, list_of_sans)
-            list_of_sans.pop()
+        # origins of the nodes on the current path, each one built from the previous one by appending a single move
+        origin_strings = [build_pgn_from_list_of_san_moves(list_of_sans)]
+        stack = [iter([(game_node, None)])]
+        while stack:
+            node_and_san = next(stack[-1], None)
+            if node_and_san is None:
+                stack.pop()
+                if len(stack) > 1:  # backtrack from a node whose move was pushed on the board
+                    board.pop()
+                    origin_strings.pop()
+                continue
+            node, san = node_and_san
+            if san is not None:
+                number_of_moves = len(list_of_sans) + len(origin_strings) - 1
+                board.push(node.move)
+                origin_strings.append(append_move_to_pgn(origin_strings[-1], number_of_moves, san))
+
+            # positions that are already in the graph (transpositions, or the same line in several games) reuse the
+            # fen of their node, which is found by position key without building a string. Otherwise board.epd() is
+            # the same as relevant_fen_part(board.fen()), but without computing the move clocks
+            fen = self.fen_by_key.get(position_key(board))
+            if fen is None:
+                fen = board.epd()
+            moves = [child.move for child in node.variations]
+            # the same few SAN strings occur at many positions, so all nodes share one string object for each
+            move_list = [sys.intern(board.san(move)) for move in moves]
+
+            self.add_moves(fen, move_list, board=board, moves=moves)
+            if len(list_of_sans) + len(origin_strings) > 1:
+                self.add_origin(fen, origin_strings[-1], from_pgn=True)
+
+            stack.append(iter(zip(node.variations, move_list)))
 
     def get_node(self, fen):
         """
@@ -106,6 +206,16 @@ class Graph(object):
         """ returns True if there is a node corresponding to fen, False otherwise"""
         return fen in self.dict
 
+    def find_fen(self, board):
+        """ returns the fen of the node corresponding to the position of board, or None if the position is not part
+        of the graph. This avoids computing the fen of board, which is expensive compared to a dictionary lookup.
+
+        Args:
+            board: (chess.Board) a board position
+        Returns: (string) the reduced fen (without move clocks) of the position, or None
+        """
+        return self.fen_by_key.get(position_key(board))
+
     def get_moves(self, fen):
         """ returns the explored moves for the position corresponding to fen
 
@@ -121,6 +231,41 @@ class Graph(object):
         moves = node.get_moves()
         return moves
 
+    def get_move(self, fen, san, board):
+        """ returns the explored move san at position fen as a chess.Move. The move is taken from the node if it is
+        known there (moves from the pgn and from saturating are), otherwise it is parsed once and stored in the node.
+
+        Args:
+            fen: (string) the fen representation of a board position which appears in the graph
+            san: (string) one of the explored moves at fen in SAN format
+            board: (chess.Board) a board representing the position fen, used for parsing san if necessary
+
+        Returns: (chess.Move) the move
+        """
+        node = self.get_node(fen)
+        move = node.move_by_san.get(san)
+        if move is None:
+            move = node.move_by_san[san] = board.parse_san(san)
+        return move
+
+    def get_successor(self, fen, san):
+        """ returns the fen of the position after the explored move san at position fen. The successors of all edges
+        are recorded while finding origins, so that this usually is a dictionary lookup, otherwise the successor is
+        computed once and stored in the node.
+
+        Args:
+            fen: (string) the fen representation of a board position which appears in the graph
+            san: (string) one of the explored moves at fen in SAN format
+
+        Returns: (string) the fen (without move clocks) of the resulting position
+        """
+        node = self.get_node(fen)
+        next_fen = node.successor_by_san.get(san)
+        if next_fen is None:
+            # copy the stored board of the position if there is one instead of parsing fen
+            next_fen = node.successor_by_san[san] = get_next_fen(fen, san, self.boards.get(fen))
+        return next_fen
+
     def get_degree(self, fen):
         """ returns the number of moves at position fen that are part of the graph """
         node = self.get_node(fen)
@@ -197,7 +342,7 @@ class Graph(object):
         node = self.get_node(fen)
         return node.get_origins()
 
-    def saturate(self, verbose=0):
+    def saturate(self, verbose=0, n_workers=None):
         """ completes the DAG represented by self by adding any opponent move for which the resulting position is
             already a node in self. This can be thought of as a kind of 'completion' or 'closure' operation.
             In other words, we add additional edges that we can get 'for free' without having to evaluate
@@ -205,27 +350,37 @@ class Graph(object):
 
             Args:
                 verbose: (int) controls how much log information is printed.
+                n_workers: (int) optional parameter. If given, the positions are split into n_workers chunks that
+                are processed in parallel by a pool of processes. Saturating never adds new nodes, so the set of
+                known positions does not change while the chunks are processed.
             """
         if verbose > 0:
             print("saturating.")
-        opposite_color_fens = [fen for fen in self.dict if fen_to_color(fen) != self.color]
-        for fen in opposite_color_fens:
-            board = chess.Board(fen)
-
-            legal_moves = list(board.legal_moves)
-
-            for move in legal_moves:
-                san = board.san(move)
-                board.push(move)
-                resulting_fen = relevant_fen_part(board.fen())
-                board.pop()
-                if resulting_fen in self.dict and san not in self.get_moves(fen):
+        # self.boards contains exactly the positions where the opposite color is to move, in the order of self.dict
+        opposite_color_boards = list(self.boards.items())
+        if n_workers is None or n_workers <= 1:
+            saturating_moves = find_saturating_moves(opposite_color_boards, self.fen_by_key, self.occupancies)
+        else:
+            known_keys = frozenset(self.fen_by_key)
+            known_occupancies = frozenset(self.occupancies)
+            chunk_size = -(-len(opposite_color_boards) // n_workers)
+            chunks = [opposite_color_boards[i:i + chunk_size]
+                      for i in range(0, len(opposite_color_boards), chunk_size)]
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = executor.map(find_saturating_moves, chunks, [known_keys] * len(chunks),
+                                       [known_occupancies] * len(chunks))
+                saturating_moves = [item for result in results for item in result]
+
+        for fen, sans_and_moves in saturating_moves:
+            node = self.get_node(fen)
+            for san, move in sans_and_moves:
+                if san not in node.explored_move_set:
                     if verbose > 0:
                         print(f"Adding {san} to {fen}")
                     if verbose > 1:
                         print_board(fen)
                         print(" ")
-                    self.add_moves(fen, [san])
+                    self.add_moves(fen, [san], moves=[move])
 
     def find_origins(self):
         """ Adds the list of origins to each node in the graph. Here, origins means a sequence of moves through which
@@ -233,28 +388,67 @@ class Graph(object):
         Requires that graph is nonempty.
         """
         list_of_sans = []
-        initial_fen = relevant_fen_part(chess.STARTING_FEN)
-        self.find_origins_in_subgraph(initial_fen, list_of_sans)
+        self.find_origins_in_subgraph(INITIAL_FEN, list_of_sans)
 
     def find_origins_in_subgraph(self, fen, list_of_sans):
-        """  Adds the list of origins to each node in the subgraph rooted at fen.
+        """  Adds the list of origins to each node in the subgraph rooted at fen. The subgraph is traversed depth first
+        along every path (since every path is an origin) using an explicit stack of iterators over the moves of the
+        nodes on the current path. A single board is kept up to date by pushing a move when descending and popping it
+        when backtracking, and the successors are looked up by their position key, so that no fen has to be parsed or
+        computed.
 
         Args:
             fen: (string) A fen representation of a board position such that fen is one of the keys of self.dict
             list_of_sans: (list) list of strings. The strings represent he moves that led to the current position in
             SAN format
         """
+        board = chess.Board(fen)
+        # origins of the nodes on the current path, each one built from the previous one by appending a single move
+        origin_strings = [build_pgn_from_list_of_san_moves(list_of_sans)]
         if len(list_of_sans) > 0:
-            self.add_origin(fen, build_pgn_from_list_of_san_moves(list_of_sans))
-
-        for san in self.get_moves(fen):
-            new_fen = get_next_fen(fen, san)
-            list_of_sans.append(san)
-            self.find_origins_in_subgraph(new_fen, list_of_sans)
-            list_of_sans.pop()
+            self.add_origin(fen, origin_strings[0])
+
+        # the nodes on the current path are kept alongside their fens, so that the loop works on the nodes directly
+        # instead of looking them up in self.dict for every edge
+        max_origins = self.max_origins
+        path = [fen]
+        nodes_on_path = [self.get_node(fen)]
+        fens_on_path = {fen}
+        stack = [iter(nodes_on_path[0].explored_moves)]
+        while stack:
+            san = next(stack[-1], None)
+            if san is None:
+                stack.pop()
+                if stack:  # backtrack to the parent of the node whose moves are exhausted
+                    board.pop()
+                    origin_strings.pop()
+                    nodes_on_path.pop()
+                    fens_on_path.remove(path.pop())
+                continue
+            parent = nodes_on_path[-1]
+            board.push(self.get_move(path[-1], san, board))
+            curr_fen = parent.successor_by_san[san] = self.find_fen(board)
+            curr_node = self.dict[curr_fen]
+            if curr_fen in fens_on_path:
+                # the move repeats a position of the current line, following it would never end
+                board.pop()
+                continue
+            number_of_moves = len(list_of_sans) + len(origin_strings) - 1
+            if max_origins is not None and len(curr_node.origins) >= max_origins:
+                # enough lines lead to this position already. The line is still recorded as an origin of the position,
+                # but no further lines through it are enumerated
+                curr_node.add_origin(append_move_to_pgn(origin_strings[-1], number_of_moves, san))
+                board.pop()
+                continue
+            origin_strings.append(append_move_to_pgn(origin_strings[-1], number_of_moves, san))
+            curr_node.add_origin(origin_strings[-1])
+            path.append(curr_fen)
+            nodes_on_path.append(curr_node)
+            fens_on_path.add(curr_fen)
+            stack.append(iter(curr_node.explored_moves))
 
     def breadth_first(self, fen):
-        """  a generator that iterates through the graph breadt first, starting at fen.
+        """  a generator that iterates through the graph breadth first, starting at fen.
 
         Args:
             fen: (string) A fen representation of a board position that appears in the graph. The root of the subtree
@@ -263,19 +457,48 @@ class Graph(object):
         Yields:
               curr_fen: (string) The fen representation of a board position that appears in the graph.
         """
-        next_fens_to_look_at = queue.Queue()
-        next_fens_to_look_at.put(fen)
+        next_fens_to_look_at = deque([fen])
         explored_fens = {fen}  # set of the fens that have already been looked at or added to queue
 
-        while not next_fens_to_look_at.empty():
-            curr_fen = next_fens_to_look_at.get()
-            for san in self.get_moves(curr_fen):
-                new_fen = get_next_fen(curr_fen, san)
+        while next_fens_to_look_at:
+            curr_fen = next_fens_to_look_at.popleft()
+            # the moves are only iterated before curr_fen is yielded, so the list of the node is not copied
+            for san in self.dict[curr_fen].explored_moves:
+                new_fen = self.get_successor(curr_fen, san)
                 if new_fen not in explored_fens:
-                    next_fens_to_look_at.put(new_fen)
+                    next_fens_to_look_at.append(new_fen)
                     explored_fens.add(new_fen)
             yield curr_fen
 
+    def breadth_first_with_boards(self, fen):
+        """  a generator that iterates through the graph breadth first, starting at fen, and also yields a chess.Board
+        for every position. The boards of the successors are obtained by copying the board of the current position
+        and pushing a move, which is much cheaper than constructing a new board from a fen.
+
+        Args:
+            fen: (string) A fen representation of a board position that appears in the graph. The root of the subtree
+            to iterate through.
+
+        Yields:
+              curr_fen: (string) The fen representation of a board position that appears in the graph.
+              board: (chess.Board) a board representing the position. The board is not used by the generator anymore
+              after it has been yielded, so the caller may push and pop moves on it.
+        """
+        board = chess.Board(fen)
+        next_fens_to_look_at = deque([(fen, board)])
+        # set of the position keys of the positions that have already been looked at or added to queue
+        explored_keys = {position_key(board)}
+
+        while next_fens_to_look_at:
+            curr_fen, board = next_fens_to_look_at.popleft()
+            for san in self.dict[curr_fen].explored_moves:
+                new_board = successor_board(board, self.get_move(curr_fen, san, board))
+                new_key = position_key(new_board)
+                if new_key not in explored_keys:
+                    next_fens_to_look_at.append((self.fen_by_key[new_key], new_board))
+                    explored_keys.add(new_key)
+            yield curr_fen, board
+
     def compute_stats(self, fen):
         """ Compute the number of nodes in the subgraph rooted at fen and the number of leaves in that subgraph
 
@@ -286,19 +509,28 @@ class Graph(object):
             num_leaves (int) The number of leaves in the subgraph
             num_nodes (int) The number of nodes in the subgraph
         """
+        # the order in which the nodes are visited does not matter for counting, so the subgraph is traversed depth
+        # first with a plain list as stack, working on the nodes directly
         num_leaves = 0
-        num_nodes = 0
-        for curr_fen in self.breadth_first(fen):
-            num_nodes += 1
-            if self.get_degree(curr_fen) == 0:
-                assert len(self.get_moves(curr_fen)) == 0
+        explored_fens = {fen}  # set of the fens that have already been looked at or added to the stack
+        fens_to_look_at = [fen]
+        while fens_to_look_at:
+            curr_fen = fens_to_look_at.pop()
+            moves = self.dict[curr_fen].explored_moves
+            if not moves:
                 num_leaves += 1
+                continue
+            for san in moves:
+                new_fen = self.get_successor(curr_fen, san)
+                if new_fen not in explored_fens:
+                    fens_to_look_at.append(new_fen)
+                    explored_fens.add(new_fen)
 
-        return num_leaves, num_nodes
+        return num_leaves, len(explored_fens)
 
     def check_all_leaves_are_opponent_color(self):
         for fen in self.dict:
-            if self.get_degree(fen) == 0 and fen_to_color(fen) == self.color:
+            if self.get_degree(fen) == 0 and self.get_node(fen).turn == self.turn:
                 origin = self.get_node(fen).origins[0]
                 raise BadOpeningGraphError(f"Line {origin} ends in leaf of own color.")
 
@@ -312,7 +544,7 @@ class Graph(object):
             num_moves (int): The number of moves by both players that have been played in order to reach the position
         """
         fen = relevant_fen_part(fen)
-        if fen == relevant_fen_part(chess.STARTING_FEN):
+        if fen == INITIAL_FEN:
             return 0
         first_origin = self.get_first_origin(fen)
         list_of_sans = build_list_of_san_moves_from_origin_string(first_origin)
@@ -325,27 +557,45 @@ class BadOpeningGraphError(Exception):
 
 class Node(object):
     """ a Node for a directed graph, storing information about edges (moves) and various extra information """
-    def __init__(self, move_list):
+    # there is one node per position, so avoid the memory overhead of an instance dictionary
+    __slots__ = ("explored_moves", "explored_move_set", "move_by_san", "successor_by_san", "out_degree", "turn",
+                 "origins", "origin_set", "num_pgn_origins")
+
+    def __init__(self, move_list, turn, moves=None):
         """
         Args:
             move_list: (list) a list of strings where each one is a chess move in SAN format (Standard Algebraic
             Notation)
+            turn: (chess.Color) the color to move in the position represented by the node
+            moves: (list) optional. The moves of move_list as chess.Move objects, in the same order
         """
         self.explored_moves = move_list.copy()
+        self.explored_move_set = set(move_list)  # same moves as explored_moves, for fast membership tests
+        # maps moves in SAN format to chess.Move objects, for those explored moves for which they are known
+        self.move_by_san = dict(zip(move_list, moves)) if moves is not None else {}
+        # maps explored moves in SAN format to the fen of the resulting position, once it has been computed
+        self.successor_by_san = {}
         self.out_degree = len(self.explored_moves)
+        self.turn = turn
         self.origins = []
+        self.origin_set = set()  # same strings as origins, for fast membership tests
         self.num_pgn_origins = 0
 
-    def add_moves(self, move_list):
+    def add_moves(self, move_list, moves=None):
         """ Add the moves in move_list to the explored moves for the chess position represented by the node,
         if they are not already there
 
         Args:
             move_list: (list) a list of strings where each one is a chess move in SAN format (Standard Algebraic
             Notation)
+            moves: (list) optional. The moves of move_list as chess.Move objects, in the same order
         """
+        if moves is not None:
+            for san, move in zip(move_list, moves):
+                self.move_by_san.setdefault(san, move)
         for move in move_list:
-            if move not in self.explored_moves:
+            if move not in self.explored_move_set:
+                self.explored_move_set.add(move)
                 self.explored_moves.append(move)
         self.out_degree = len(self.explored_moves)
 
@@ -376,7 +626,8 @@ class Node(object):
              origin_string: (string) a series of moves in san format that leads to the current position
              from_pgn: (bool) True if the line represented by origin_string was found directly in pgn
          """
-        if origin_string not in self.origins:
+        if origin_string not in self.origin_set:
+            self.origin_set.add(origin_string)
             self.origins.append(origin_string)
             if from_pgn:
                 self.num_pgn_origins += 1
@@ -393,12 +644,11 @@ class Node(object):
 
     def print_origins(self):
         """print the lines in self.origins, adding 'pgn' to indicate that a line was found directly in the pgn.
-        This is determined based on num_pgn_origins """
-        for i, s in enumerate(self.origins):
-            if i < self.num_pgn_origins:
-                print(s, "(pgn)")
-            else:
-                print(s)
+        This is determined based on num_pgn_origins. Positions can have thousands of origins, so all lines are
+        written at once instead of printing them one by one."""
+        if self.origins:
+            lines = [s + " (pgn)" if i < self.num_pgn_origins else s for i, s in enumerate(self.origins)]
+            print("\n".join(lines))
 
     def get_first_origin(self):
         """ returns the first origin, if it exists. Otherwise, throw index error.
@@ -419,6 +669,68 @@ class Node(object):
         return self.origins.copy()
 
 
+def build_graph_from_games(color, games):
+    """ builds a graph from games without saturating it or finding origins. This is the part of
+    Graph.consume_pgn_games_in_parallel that runs in a separate process.
+
+    Args:
+        color: (string) Either "w" or "b"
+        games: (list) a list of chess.pgn.Game objects
+
+    Returns: (Graph) the graph
+    """
+    graph = Graph(color, [])
+    for game in games:
+        graph.consume_pgn_game(game)
+    return graph
+
+
+def find_saturating_moves(boards, known_keys, known_occupancies=None):
+    """ For each position in boards, finds the legal moves that lead to a position whose util.position_key is in
+    known_keys. This is the part of Graph.saturate that does not modify the graph, so that it can run in a separate
+    process.
+
+    Args:
+        boards: (list) a list of pairs (fen, board), where board is a chess.Board representing fen. Moves are pushed
+        on the boards and popped again, so the boards are unchanged afterwards.
+        known_keys: a container of position keys that supports the in operator
+        known_occupancies: optional. A container of the pairs (squares occupied by white, squares occupied by black)
+        of the known positions, as bitboards. Ordinary moves whose resulting occupancy is not in it are skipped
+        without pushing them on the board, which is much cheaper than computing the position key.
+
+    Returns:
+        a list of pairs (fen, sans_and_moves), where sans_and_moves is a list of pairs (san, move) for the moves from
+        fen into a known position, both in SAN format and as chess.Move
+    """
+    result = []
+    check_occupancy = known_occupancies is not None
+    bb_squares = chess.BB_SQUARES
+    for fen, board in boards:
+        sans_and_moves = []
+        white_to_move = board.turn == chess.WHITE
+        occupied_by_mover = board.occupied_co[board.turn]
+        occupied_by_other = board.occupied_co[not board.turn]
+        # bind the methods used for every legal move to local names, which are faster to look up
+        is_castling, is_en_passant, push, pop = board.is_castling, board.is_en_passant, board.push, board.pop
+        # generate the moves lazily instead of materializing the list of legal moves
+        for move in board.generate_legal_moves():
+            if check_occupancy and not is_castling(move) and not is_en_passant(move):
+                # for all other moves (including captures and promotions) the piece simply goes from one square to
+                # the other, so the occupancy after the move can be computed without pushing it
+                from_bb, to_bb = bb_squares[move.from_square], bb_squares[move.to_square]
+                mover_after = (occupied_by_mover & ~from_bb) | to_bb
+                other_after = occupied_by_other & ~to_bb
+                occupancy = (mover_after, other_after) if white_to_move else (other_after, mover_after)
+                if occupancy not in known_occupancies:
+                    continue
+            push(move)
+            is_known = position_key(board) in known_keys
+            pop()
+            # only compute the SAN (which is expensive) for the few moves that lead to a known position
+            if is_known:
+                sans_and_moves.append((sys.intern(board.san(move)), move))
+        result.append((fen, sans_and_moves))
+    return result
 
 
 def print_board(fen):
@@ -625,8 +937,55 @@ def test7():
         raise Exception("should not reach here. BadOpeningGraphError was not successfully raised and caught")
 
 
+def test8():
+    """ test case 8: building the graph with several processes gives the same graph as building it serially. """
+    print(" ")
+    print("Test case 8")
+    games = read_pgn_files_in_directory(pathlib.Path("../data/black"))
+    serial_graph = Graph("b", games)
+    parallel_graph = Graph("b", games, n_workers=3)
+
+    assert list(serial_graph.dict) == list(parallel_graph.dict)
+    for fen, node in serial_graph.dict.items():
+        parallel_node = parallel_graph.get_node(fen)
+        assert node.explored_moves == parallel_node.explored_moves, fen
+        assert node.origins == parallel_node.origins, fen
+        assert node.num_pgn_origins == parallel_node.num_pgn_origins, fen
+        assert node.successor_by_san == parallel_node.successor_by_san, fen
+    print(f"serial and parallel graph agree on all {len(serial_graph.dict)} nodes")
+
+
+def test9():
+    """ test case 9: finding origins with a small max_origins. """
+    print(" ")
+    print("Test case 9")
+    games = read_pgn_files_in_directory(pathlib.Path("../data/black"))
+    graph = Graph("b", games)
+    capped_graph = Graph("b", games, max_origins=2)
+
+    assert list(graph.dict) == list(capped_graph.dict)
+    num_origins = 0
+    num_capped_origins = 0
+    for fen, node in graph.dict.items():
+        capped_origins = capped_graph.get_node(fen).origins
+        if fen != INITIAL_FEN:
+            assert len(capped_origins) > 0, fen
+        # the capped graph finds a subset of the lines, starting with the same first origin
+        assert set(capped_origins) <= node.origin_set, fen
+        assert capped_origins[:1] == node.origins[:1], fen
+        for origin in capped_origins:
+            board = chess.Board()
+            for san in build_list_of_san_moves_from_origin_string(origin):
+                board.push_san(san)
+            assert board.epd() == fen, (fen, origin)
+        num_origins += len(node.origins)
+        num_capped_origins += len(capped_origins)
+    assert num_capped_origins < num_origins
+    print(f"number of origins: {num_origins}, with max_origins=2: {num_capped_origins}")
+
+
 def run_tests():
-    tests = [test1, test2, test3, test4, test5, test6, test7]
+    tests = [test1, test2, test3, test4, test5, test6, test7, test8, test9]
     for test in tests:
         test()
 
@@ -1,12 +1,18 @@
 import chessgraph
 import chess
 import chess.pgn
+import functools
+from collections import deque
+import heapq
 import random
 import pathlib
 from util import read_pgn_files_in_directory
 import util
 
 
+MAX_MOVES_TO_PRINT = 20  # maximum number of explored moves listed with their statistics in explore mode
+
+
 def check_exit(user_input):
     """ checks whether the string user_input is 'exit' or 'quit'. If so, exits
 
@@ -29,10 +35,10 @@ def ask_for_input(prompt, options, case_sensitive=True):
         the option selected by the user
     """
     prompt_to_print = prompt + '\n'
-    if not case_sensitive:
-        options_for_comparison = [s.lower() for s in options]
-    else:
-        options_for_comparison = options
+    # maps the strings that the input is compared with to the options, keeping the first option for each string
+    option_by_input = {}
+    for s in options:
+        option_by_input.setdefault(s if case_sensitive else s.lower(), s)
     while True:
         user_input = input(prompt_to_print)
         user_input = user_input.strip()
@@ -42,25 +48,20 @@ def ask_for_input(prompt, options, case_sensitive=True):
         check_exit(user_input)
         if user_input == "":
             prompt_to_print = ""  # allow user to create white space by entering empty string
-        elif user_input in options_for_comparison:
-            break
+        elif user_input in option_by_input:
+            return option_by_input[user_input]
         else:
             print(f"Could not parse '{orig_user_input}'. Enter 'exit' in order to exit the program. \n")
             prompt_to_print = prompt + '\n'
-    for i, s in enumerate(options_for_comparison):
-        if user_input == s:
-            return options[i]
-    raise Exception(f"should not reach here. user_input is {user_input}. options is {options}.")
 
 
 def ask_to_enter_anything(prompt, options):
-    lowercase_options = [s.lower() for s in options]
     user_input = input(prompt + '\n')
     user_input = user_input.lower().strip()
     check_exit(user_input)
-    for i, s in enumerate(lowercase_options):
-        if user_input == s:
-            return options[i]
+    for s in options:
+        if user_input == s.lower():
+            return s
     return None
 
 
@@ -68,7 +69,7 @@ def main():
     """ask user for options and then run corresponding part of the program"""
     print("Enter 'exit' at any time in order to exit the program.")
     params = {}
-    params['fen'] = util.relevant_fen_part(chess.STARTING_FEN)
+    params['fen'] = util.INITIAL_FEN
     params['mode'] = ask_for_input("Choose mode. Either 'practice' or 'explore'. or 'lookup'.",
                                    ['practice', 'explore', 'lookup'], case_sensitive=False)
     color = ask_for_input(f"Enter 'b' or 'w' to indicate which color you want play as",
@@ -108,7 +109,7 @@ def explore_tree(params):
     Args:
         params (dict): parameters
     """
-    initial_fen = util.relevant_fen_part(chess.STARTING_FEN)
+    initial_fen = util.INITIAL_FEN
     fen = params['fen']
     list_of_sans = params['list_of_sans'].copy()
     board = chess.Board()
@@ -117,29 +118,30 @@ def explore_tree(params):
     if len(list_of_sans) > 0:
         for san in list_of_sans:
             board.push_san(san)
-            stack.append(util.relevant_fen_part(board.fen()))
+            stack.append(board.epd())
         #  remove last entry of stack and compare it to fen:
         last_entry = stack.pop()
         assert last_entry == fen
 
     skip_print = False
     graph = params['graph']
+    general_options = ['b', 'origin', 'lookup', 'practice']
+    general_prompts = "Enter 'b' to go back to previous position.\n" \
+                      "Enter 'origin' to print the origins of this position. " \
+                      "Enter 'lookup' in order to look up a position. " \
+                      "Enter 'practice' in order to practice from this position."
 
     while True:
         if not skip_print:
             print_basic_position_information(graph, fen, list_of_sans, include_number_of_origins=True)
 
-        general_options = ['b', 'origin', 'lookup', 'practice']
-        general_prompts = "Enter 'b' to go back to previous position.\n" \
-                          "Enter 'origin' to print the origins of this position. " \
-                          "Enter 'lookup' in order to look up a position. " \
-                          "Enter 'practice' in order to practice from this position."
-        if util.fen_to_color(fen) == graph.color:
+        color_to_move = util.fen_to_color(fen)
+        if color_to_move == graph.color:
             skip_print = False
             if fen == initial_fen:
                 user_input = None  # go directly to position after first move
             else:
-                print_which_color_to_move(fen)
+                print_which_color_to_move(fen, color_to_move)
                 prompt = "Press Enter to continue." + " " + general_prompts
                 options = general_options
                 user_input = ask_to_enter_anything(prompt, options)
@@ -149,23 +151,24 @@ def explore_tree(params):
                 san = moves[0]
                 stack.append(fen)
                 list_of_sans.append(san)
-                fen = util.get_next_fen(fen, san)
+                fen = graph.get_successor(fen, san)
                 continue
-        else:  # util.fen_to_color(fen) != graph.color
-            print_which_color_to_move(fen)
+        else:  # color_to_move != graph.color
+            print_which_color_to_move(fen, color_to_move)
             prompt = "Enter one of the moves in SAN format in order to execute the move." + " " + general_prompts
-            if not skip_print and graph.get_degree(fen) > 0:
-                print_explored_moves_and_statistics(graph, fen)
-            elif graph.get_degree(fen) == 0:
+            moves = graph.get_moves(fen)
+            if not skip_print and len(moves) > 0:
+                print_explored_moves_and_statistics(graph, fen, moves)
+            elif len(moves) == 0:
                 print("Reached leaf in opening graph. No more moves explored.")
                 prompt = general_prompts
             skip_print = False
-            options = graph.get_moves(fen) + general_options
+            options = moves + general_options
             user_input = ask_for_input(prompt, options)
-            if user_input in graph.get_moves(fen):
+            if user_input in moves:
                 stack.append(fen)
                 list_of_sans.append(user_input)
-                fen = util.get_next_fen(fen, user_input)
+                fen = graph.get_successor(fen, user_input)
                 continue
         if user_input == 'b':
             if len(stack) > 0:
@@ -207,7 +210,8 @@ def practice_openings(params):
     fen = params['fen']
     list_of_sans = params['list_of_sans'].copy()
     general_options = ['restart', 'explore', 'lookup', 'depth', 'move_selection']
-    own_moves_before_start = (len(list_of_sans) // 2 if graph.color == 'b' else (len(list_of_sans) + 1) // 2)
+    own_moves_before_start = number_of_own_moves(graph, list_of_sans)
+    max_plies = 2 * params['max_depth'] - 1  # practice ends once this many moves have been played
     opponent_moves = None  # opponent_moves will be a dict containing the opponent's moves for random-leaf mode
 
     if own_moves_before_start >= params['max_depth']:
@@ -223,8 +227,18 @@ def practice_openings(params):
         if opponent_moves is None and params['move_selection'] == 'random-leaf':
             leaf_list = leaves(graph, params['max_depth'], fen)
             target_leaf = random.choice(leaf_list)
-            origins_containing_fen = [origin for origin in graph.get_origins(target_leaf) if contains_fen(origin, fen)]
-            chosen_line = random.choice(origins_containing_fen)
+            if fen == util.INITIAL_FEN:
+                origins_containing_fen = graph.get_origins(target_leaf)  # every line starts in the initial position
+            else:
+                fen_key = util.position_key(chess.Board(fen))
+                origins_containing_fen = [origin for origin in graph.get_origins(target_leaf)
+                                          if fen_key in position_keys_of_origin(origin)]
+            if len(origins_containing_fen) > 0:
+                chosen_line = random.choice(origins_containing_fen)
+            else:
+                # with graph.max_origins, the stored origins of target_leaf may all bypass fen
+                chosen_line = util.build_pgn_from_list_of_san_moves(
+                    list_of_sans + line_between_positions(graph, fen, target_leaf))
             opponent_moves = move_dict_from_origin(chosen_line)
         if util.fen_to_color(fen) == graph.color:
             print_basic_position_information(graph, fen, list_of_sans)
@@ -232,14 +246,14 @@ def practice_openings(params):
             correct_san = move_list[0]
             legal_moves = list_of_legal_moves(fen)
             assert correct_san in legal_moves
-            options = legal_moves + general_options
+            options = list(legal_moves) + general_options
             prompt = "Enter your move.\n" \
                      "Or enter 'restart' to restart. Enter 'explore' or 'lookup' to switch to a different mode.\n" \
                      "Enter 'depth' to change the maximum depth or 'move_selection' to change the move selection mode."
             user_input = ask_for_input(prompt, options)
 
             if user_input == correct_san:
-                fen = util.get_next_fen(fen, correct_san)
+                fen = graph.get_successor(fen, correct_san)
                 list_of_sans.append(correct_san)
                 continue
 
@@ -253,18 +267,18 @@ def practice_openings(params):
             # opponent chooses move at random where the probability for each choice is proportional to the number
             # of leaves in the subgraph corresponding to that choice
             print_basic_position_information(graph, fen, list_of_sans)
-            if graph.get_degree(fen) > 0 and len(list_of_sans) < 2 * params['max_depth'] - 1:
-                move_list = graph.get_moves(fen)
+            move_list = graph.get_moves(fen)
+            if len(move_list) > 0 and len(list_of_sans) < max_plies:
                 if params['move_selection'] == 'uniform':
                     san = random.choice(move_list)
                 elif params['move_selection'] == 'random-leaf':
                     san = opponent_moves[fen]
                 else:
                     raise Exception(f"Should not reach here. params['move_selection'] is {params['move_selection']}")
-                fen = util.get_next_fen(fen, san)
+                fen = graph.get_successor(fen, san)
                 list_of_sans.append(san)
                 continue
-            elif len(list_of_sans) >= 2 * params['max_depth'] - 1:
+            elif len(list_of_sans) >= max_plies:
                 print("Success!! You reached the maximum depth. Enter 'depth' in order to change the max depth.")
                 user_input = ask_to_enter_anything("Press enter to continue.", general_options)
                 if user_input is None:
@@ -299,10 +313,9 @@ def practice_openings(params):
             else:
                 assert int(depth_input) in range(2, 101)
                 params['max_depth'] = int(depth_input)
+                max_plies = 2 * params['max_depth'] - 1
                 opponent_moves = None
-                # number of moves already played before the current position
-                already_played = (len(list_of_sans) // 2 if graph.color == 'b' else (len(list_of_sans) + 1) // 2)
-                if already_played >= params['max_depth']:
+                if number_of_own_moves(graph, list_of_sans) >= params['max_depth']:
                     print("This depth has been reached already. Restarting from the initial position.")
                     fen = params['fen']
                     list_of_sans = params['list_of_sans'].copy()
@@ -331,12 +344,16 @@ def look_up_position(params):
     fen = params['fen']
 
     board = chess.Board()
+    # fens of the positions before each move of list_of_sans, so that going back does not need to compute them again
+    stack = []
     for san in list_of_sans:
+        stack.append(board.epd())
         board.push_san(san)
 
     skip_print_and_lookup = False
 
     while True:
+        legal_moves = list_of_legal_moves(fen)
         if not skip_print_and_lookup:
             print_basic_position_information(graph, fen, list_of_sans, include_number_of_origins=False)
             if graph.color == 'w':
@@ -345,26 +362,27 @@ def look_up_position(params):
                 color_word = 'black'
             question = "Is position part of " + color_word + " opening graph?"
             if graph.node_exists(fen):
-                print(question, "Yes.")
-                print("Enter 'explore' to enter exploration mode. Enter 'practice' to practice from this position.\n"
+                print(question, "Yes.\n"
+                      "Enter 'explore' to enter exploration mode. Enter 'practice' to practice from this position.\n"
                       "Enter 'origin' in order to see origins for this position.")
-                options = ['practice', 'origin', 'explore', 'b'] + list_of_legal_moves(fen)
+                options = ['practice', 'origin', 'explore', 'b'] + list(legal_moves)
             else:
                 print(question, "No.")
-                options = ['b'] + list_of_legal_moves(fen)
+                options = ['b'] + list(legal_moves)
         skip_print_and_lookup = False
         prompt = "Enter a move in SAN format. Enter 'b' to go back. "
         user_input = ask_for_input(prompt, options)
 
-        if user_input in list_of_legal_moves(fen):
+        if user_input in legal_moves:
+            stack.append(fen)
             board.push_san(user_input)
             list_of_sans.append(user_input)
-            fen = util.relevant_fen_part(board.fen())
+            fen = board.epd()
         elif user_input == 'b':
             if len(list_of_sans) > 0:
                 list_of_sans.pop()
                 board.pop()
-                fen = util.relevant_fen_part(board.fen())
+                fen = stack.pop()
             else:
                 print("Cannot go back. This is already the starting position.")
         elif user_input == 'origin':
@@ -378,7 +396,7 @@ def look_up_position(params):
             # since current list_of_sans may not be part of opening tree, parse new list of sans from origin string
             if len(list_of_sans) > 0:
                 origin_string = graph.get_first_origin(fen)
-                params['list_of_sans'] = util.build_list_of_san_moves_from_origin_string(origin_string)
+                params['list_of_sans'] = list(util.build_list_of_san_moves_from_origin_string(origin_string))
             else:
                 params['list_of_sans'] = []
             if user_input == 'practice':
@@ -391,27 +409,30 @@ def look_up_position(params):
 
 
 def print_basic_position_information(graph, fen, list_of_sans, include_number_of_origins=False):
-    """ print basic information about the position """
-    print("========================================================================")
+    """ print basic information about the position. The lines are collected first and printed at once. """
+    lines = ["========================================================================"]
     if len(list_of_sans) > 0:
-        print(util.build_pgn_from_list_of_san_moves(list_of_sans))
+        lines.append(util.build_pgn_from_list_of_san_moves(list_of_sans))
     else:
-        print("Initial position.")
-    print("FEN:", fen)
-    print("========================================================================")
+        lines.append("Initial position.")
+    lines.append("FEN: " + fen)
+    lines.append("========================================================================")
     if len(list_of_sans) > 0 and include_number_of_origins:
         num_origins, _ = graph.get_number_of_origins(fen)
-        print(f"The number of lines leading to this position (number of origins) is {num_origins}.")
+        lines.append(f"The number of lines leading to this position (number of origins) is {num_origins}.")
+    print("\n".join(lines))
 
 
-def print_which_color_to_move(fen):
+def print_which_color_to_move(fen, color=None):
     """ print a message stating which player is to move in the position represented by fen
 
     Args:
         fen: (string) the fen representation of a board position. Can also be only the first parts of a FEN, without
         the move clocks.
+        color: (string) optional. 'w' or 'b', the color to move in fen if the caller already knows it.
     """
-    color = util.fen_to_color(fen)
+    if color is None:
+        color = util.fen_to_color(fen)
     if color == 'w':
         print("White to move.")
     elif color == 'b':
@@ -420,28 +441,26 @@ def print_which_color_to_move(fen):
         raise Exception(f"Should not reach here. Variable color has value {color}.")
 
 
-def contains_fen(origin_string, fen):
-    """  returns True if the board position described by fen occurs during the sequence of moves described by
-      origin_string, False otherwise
+@functools.lru_cache(maxsize=8192)
+def position_keys_of_origin(origin_string):
+    """  returns the position keys (see util.position_key) of all the board positions occurring during the sequence of
+    moves described by origin_string, including the initial position. The positions are compared by their keys, which
+    are much cheaper to compute than fens, and the result is memoized, so that every line is only replayed once no
+    matter how many positions are looked up in it.
 
-      Args:
-          origin_string: (string) a series of moves in SAN format starting from the initial board position
-          fen: (string) the fen representation of a board position which appears in the graph and therefore in
-            self.dict. More specifically, fen is not in FEN format but in a reduced FEN format where the move clocks
-            are not included
-      Returns:
-          (bool) boolean indicating whether the position occurs
+    Args:
+        origin_string: (string) a series of moves in SAN format starting from the initial board position
+    Returns:
+        (frozenset) the position keys
     """
-    fen = util.relevant_fen_part(fen)
-    list_of_sans = util.build_list_of_san_moves_from_origin_string(origin_string)
-    current_fen = util.relevant_fen_part(chess.STARTING_FEN)
-    if current_fen == fen:
-        return True
-    for san in list_of_sans:
-        current_fen = util.get_next_fen(current_fen, san)
-        if current_fen == fen:
-            return True
-    return False
+    # the line is replayed from its moves in uci format, which are memoized per origin string and do not need to be
+    # parsed against the legal moves of each position like moves in SAN format
+    board = chess.Board()
+    keys = {util.position_key(board)}
+    for uci in util.translate_origin_string_into_list_of_uci(origin_string):
+        board.push(chess.Move.from_uci(uci))
+        keys.add(util.position_key(board))
+    return frozenset(keys)
 
 
 def move_dict_from_origin(origin_string):
@@ -453,32 +472,55 @@ def move_dict_from_origin(origin_string):
     Returns:
         move_dict (dict): maps board positions to the next move as it occurs in origin_string.
     """
+    return dict(positions_and_moves_of_origin(origin_string))
+
+
+@functools.lru_cache(maxsize=8192)
+def positions_and_moves_of_origin(origin_string):
+    """ replays the game described by origin_string and returns the pairs (position, next move) for all positions
+    except the final one. The result is memoized, since practice mode picks the same lines again and again.
+
+    Args:
+        origin_string (string): a series of moves in SAN format starting from the initial board position
+    Returns:
+        (tuple) a tuple of pairs (fen, san), where fen is the reduced fen of a position and san the move played in it
+    """
     list_of_sans = util.build_list_of_san_moves_from_origin_string(origin_string)
-    move_dict = {}
-    current_fen = util.relevant_fen_part(chess.STARTING_FEN)
-    for san in list_of_sans:
-        move_dict[current_fen] = san
-        current_fen = util.get_next_fen(current_fen, san)
-    return move_dict
+    list_of_uci = util.translate_origin_string_into_list_of_uci(origin_string)
+    positions_and_moves = []
+    board = chess.Board()
+    for san, uci in zip(list_of_sans, list_of_uci):
+        positions_and_moves.append((board.epd(), san))
+        board.push(chess.Move.from_uci(uci))
+    return tuple(positions_and_moves)
 
 
-def print_explored_moves_and_statistics(graph, fen):
+def print_explored_moves_and_statistics(graph, fen, moves):
     """ print the explored moves in graph for position fen as well as the number of children,
     leaves and nodes below the nodes resulting from the move. Since this function is always called
     with fen representing a position of color != graph.color, the positions arising after making
     a move have only one child, each. Therefore we print the number of children that child instead
-    of printing '1' as number of children for every move (which would not be informative). """
-    print("Explored moves:")
-    moves = graph.get_moves(fen)
-    stats = stats_for_moves(graph, fen)
-    moves.sort(key=lambda x: stats[x][1], reverse=True)
-    for i, san in enumerate(moves):
+    of printing '1' as number of children for every move (which would not be informative).
+
+    Args:
+        graph (chessgraph.Graph): the opening graph we are considering
+        fen (string): the fen representation of a board position that appears in graph
+        moves (list): the explored moves at fen, as returned by graph.get_moves(fen). The list is not modified.
+    """
+    lines = ["Explored moves:"]
+    stats = stats_for_moves(graph, fen, moves)
+    # only the moves with the most leaves are listed, all explored moves can still be entered
+    top_moves = heapq.nlargest(MAX_MOVES_TO_PRINT, moves, key=lambda x: stats[x][1])
+    for i, san in enumerate(top_moves):
         num_children, num_leaves, num_nodes = stats[san]
-        print(f"{i+1:2}) {san:3}  [children: {num_children:3}, "
-              f"leaves: {num_leaves:3}, nodes: {num_nodes:3}]")
+        lines.append(f"{i+1:2}) {san:3}  [children: {num_children:3}, "
+                     f"leaves: {num_leaves:3}, nodes: {num_nodes:3}]")
+    if len(moves) > len(top_moves):
+        lines.append(f"...and {len(moves) - len(top_moves)} more")
+    print("\n".join(lines))
 
 
-def stats_for_moves(graph, fen):
+def stats_for_moves(graph, fen, moves):
     """  for each of the explored moves at the position specified by fen, compute number of children, as well as
     number of leaves and number of nodes in the subtree rooted at the node. Return a dictionary containing this
     information
@@ -486,22 +528,39 @@ def stats_for_moves(graph, fen):
     Args:
         graph (chessgraph.Graph): the opening graph we are considering
         fen (string): the fen representation of a board position that appears in graph
+        moves (list): the explored moves at fen, as returned by graph.get_moves(fen)
 
     Returns:
         stats (dict): keys are explored moves in SAN notation. values are triples (num_children, num_leaves, num_nodes)
     """
     stats = {}
-    moves = graph.get_moves(fen)
-    for i, san in enumerate(moves):
-        new_fen = util.get_next_fen(fen, san)
-        new_san = graph.get_moves(new_fen)[0]
-        new_new_fen = util.get_next_fen(new_fen, new_san)
-        num_children = graph.get_degree(new_new_fen)
-        num_leaves, num_nodes = graph.compute_stats(new_fen)
-        stats[san] = (num_children, num_leaves, num_nodes)
+    for san in moves:
+        stats[san] = stats_for_move(graph, fen, san)
     return stats
 
 
+@functools.lru_cache(maxsize=16384)
+def stats_for_move(graph, fen, san):
+    """  compute number of children, as well as number of leaves and number of nodes in the subtree rooted at the node
+    resulting from the explored move san at the position specified by fen. The result is memoized, since the graph does
+    not change anymore once it is built and the user tends to come back to the same positions.
+
+    Args:
+        graph (chessgraph.Graph): the opening graph we are considering
+        fen (string): the fen representation of a board position that appears in graph
+        san (string): one of the explored moves at fen in SAN notation
+
+    Returns:
+        (tuple) the triple (num_children, num_leaves, num_nodes)
+    """
+    new_fen = graph.get_successor(fen, san)
+    new_san = graph.get_moves(new_fen)[0]
+    new_new_fen = graph.get_successor(new_fen, new_san)
+    num_children = graph.get_degree(new_new_fen)
+    num_leaves, num_nodes = graph.compute_stats(new_fen)
+    return num_children, num_leaves, num_nodes
+
+
 def leaves(graph, depth, fen):
     """  returns a list of the nodes at which practice mode can end. Specifically, these are nodes that lie below fen
     in the graph and either represent a position where the depth'th move of the color graph.color has just been played,
@@ -516,41 +575,84 @@ def leaves(graph, depth, fen):
         leaf_list (list) : a list of strings. Each string is the fen representation of a board position
     """
     leaf_list = []
+    max_num_moves = 2 * depth
+    min_num_moves_at_end = 2 * (depth - 1)
+    color = graph.color
     for curr_fen in graph.breadth_first(fen):
         num_moves = graph.number_of_moves(curr_fen)
-        if num_moves > 2 * depth:
+        if num_moves > max_num_moves:
             break
         if graph.get_degree(curr_fen) == 0:  # leaf
             leaf_list.append(curr_fen)
-        elif num_moves > 2 * (depth - 1) and util.fen_to_color(curr_fen) != graph.color:
+        elif num_moves > min_num_moves_at_end and util.fen_to_color(curr_fen) != color:
             leaf_list.append(curr_fen)
     return leaf_list
 
 
+def line_between_positions(graph, fen, target_fen):
+    """ returns a shortest sequence of explored moves that leads from fen to target_fen in graph
+
+    Args:
+        graph (chessgraph.Graph): the opening graph we are considering
+        fen (string): The fen representation of a board position in graph
+        target_fen (string): The fen representation of a board position in graph that lies below fen
+
+    Returns:
+        list_of_sans (list): the moves in SAN format
+    """
+    # maps every position reached so far to the position and the move it was reached from
+    predecessors = {fen: None}
+    next_fens_to_look_at = deque([fen])
+    while target_fen not in predecessors:
+        curr_fen = next_fens_to_look_at.popleft()
+        for san in graph.get_moves(curr_fen):
+            new_fen = graph.get_successor(curr_fen, san)
+            if new_fen not in predecessors:
+                predecessors[new_fen] = (curr_fen, san)
+                next_fens_to_look_at.append(new_fen)
+    list_of_sans = []
+    curr_fen = target_fen
+    while predecessors[curr_fen] is not None:
+        curr_fen, san = predecessors[curr_fen]
+        list_of_sans.append(san)
+    list_of_sans.reverse()
+    return list_of_sans
+
+
+def number_of_own_moves(graph, list_of_sans):
+    """ returns the number of moves that the color graph.color has played in the line list_of_sans
+
+    Args:
+        graph (chessgraph.Graph): the opening graph we are considering
+        list_of_sans (list): moves in SAN format starting from the initial position
+
+    Returns:
+        (int) the number of moves of color graph.color in list_of_sans
+    """
+    if graph.color == 'b':
+        return len(list_of_sans) // 2
+    return (len(list_of_sans) + 1) // 2
+
+
+@functools.lru_cache(maxsize=4096)
 def list_of_legal_moves(fen):
-    """ returns a list of all legal moves for the position in SAN format
+    """ returns all legal moves for the position in SAN format. The result is memoized, since the same positions are
+    visited over and over again (e.g. when going back and forth in lookup mode).
 
     Args:
         fen: (string) the FEN (Forsyth-Edwards-Notation) representation of a chess position. More specifically, the
               first four parts of a FEN, without the move-clocks
     Returns:
-        (list) a list of strings, each one the SAN representation of a legal move for the position
+        (tuple) a tuple of strings, each one the SAN representation of a legal move for the position
     """
     board = chess.Board(fen)
-    return [board.san(move) for move in board.legal_moves]
+    return tuple(board.san(move) for move in board.legal_moves)
 
 
 def weighted_random_choice(choices, weights):
     """ returns one of the elements of choices at random where the probability for each choices[i] is proportional to
     weights[i]"""
-    random_number = random.random()
-    total_weight = sum(weights)
-    aggregate = 0
-    for i, element in enumerate(choices):
-        aggregate = aggregate + weights[i]
-        if aggregate / total_weight > random_number:
-            return element
-    raise Exception(f"should not reach here. weights is {weights}.")
+    return random.choices(choices, weights=weights)[0]
 
 if __name__ == "__main__":
     main()
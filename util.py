@@ -1,3 +1,4 @@
+import functools
 import chess
 
 
@@ -27,9 +28,8 @@ def fen_to_color(fen):
 
     Returns: (string) "b" if it is black's turn or "w" if it is white's turn
     """
-    parts = fen.split()
-    turn_part = parts[1]
-    return turn_part
+    # the color is the single character right after the first space, so there is no need to split the whole fen
+    return fen[fen.index(' ') + 1]
 
 
 def relevant_fen_part(fen):
@@ -40,6 +40,14 @@ def relevant_fen_part(fen):
         fen: (string) a full FEN such as "rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2"
     Returns: (string) the relevant part of the FEN, e.g. "rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq -"
     """
+    num_spaces = fen.count(' ')
+    if (num_spaces == 5 or num_spaces == 3) and '  ' not in fen and fen == fen.strip():
+        # the fields are separated by single spaces, so the fen does not need to be split into all its parts
+        if num_spaces == 5:
+            # a regular full FEN: only cut off the two move clocks
+            return fen.rsplit(' ', 2)[0]
+        # already reduced, as are all the fens stored in the graph
+        return fen
     parts = fen.split()
     relevant_parts = parts[:4]
     separator = ' '
@@ -47,7 +55,26 @@ def relevant_fen_part(fen):
     return new_fen
 
 
-def get_next_fen(fen, san):
+# the relevant part of the FEN of the initial position, which is compared against in several places
+INITIAL_FEN = relevant_fen_part(chess.STARTING_FEN)
+
+
+def position_key(board):
+    """ returns a hashable key identifying the board position, for use as a dictionary key instead of a fen.
+
+    Two boards get the same key if and only if relevant_fen_part(board.fen()) is the same for both, i.e. the key
+    covers the piece placement, the color to move, the castling rights and the en passant square (only if an en
+    passant capture is legal), but not the move clocks. Computing the key does not build any strings and is far
+    cheaper than computing a fen.
+
+    Args:
+        board: (chess.Board) the board position
+    Returns: (tuple) the key of the position
+    """
+    return board._transposition_key()
+
+
+def get_next_fen(fen, san, board=None):
     """
     Returns the next board position after executing the move represented by san in the position represented by fen
 
@@ -55,13 +82,14 @@ def get_next_fen(fen, san):
         fen: (string) current board position in FEN format. More specifically, the first four parts of a FEN,
         without the move-clocks
         san: (string) move in SAN format
+        board: (chess.Board) optional. A board representing fen. If given, it is copied instead of parsing fen, which
+        is much cheaper. The board itself is not modified.
     Returns: (string) the next board position in fen format. More specifically, the first four parts of a FEN,
         without the move-clocks
     """
-    board = chess.Board(fen)
+    board = chess.Board(fen) if board is None else board.copy(stack=False)
     board.push_san(san)
-    new_full_fen = board.fen()
-    return relevant_fen_part(new_full_fen)
+    return board.epd()  # the same as relevant_fen_part(board.fen()), but without computing the move clocks
 
 
 def build_pgn_from_list_of_san_moves(list_of_sans):
@@ -73,37 +101,58 @@ def build_pgn_from_list_of_san_moves(list_of_sans):
     Returns: (string) a string where all the moves in list_of_sans are combined into one string and numbers are
     added for turns. In other words, the string represents the game in standard algebraic notation.
     """
-    if len(list_of_sans) == 0:
-        return ""
+    # white's moves are preceded by the number of the turn, which is directly computed from the index of the move
+    return " ".join(f"{ii // 2 + 1}. {san}" if ii % 2 == 0 else san for ii, san in enumerate(list_of_sans))
+
 
-    new_list = []
-    count = 0
-    for ii in range(len(list_of_sans)):
-        if ii % 2 == 0:
-            count += 1
-            new_list.append(str(count) + ".")
-        new_list.append(list_of_sans[ii])
-    return " ".join(new_list)
+def append_move_to_pgn(pgn, number_of_moves, san):
+    """ appends a move to a string built by build_pgn_from_list_of_san_moves, adding the number of the turn if
+    necessary. Only the new move is formatted, so that lines can be built incrementally.
+
+    Args:
+        pgn: (string) the string returned by build_pgn_from_list_of_san_moves for some list of moves
+        number_of_moves: (int) the number of moves in that list
+        san: (string) the move to append in SAN format
+    Returns: (string) the same as build_pgn_from_list_of_san_moves for the list of moves with san appended
+    """
+    if number_of_moves % 2 == 0:
+        san = str(number_of_moves // 2 + 1) + ". " + san
+    if number_of_moves == 0:
+        return san
+    return pgn + " " + san
 
 
+@functools.lru_cache(maxsize=8192)
 def build_list_of_san_moves_from_origin_string(origin_string):
-    """ parses a string that represents a sequence of moves into a list containing the sequence of moves
+    """ parses a string that represents a sequence of moves into a tuple containing the sequence of moves. The result
+    is memoized for the most recently used origin strings, since the same origin strings are parsed over and over again
+    while traversing the graph.
 
     Args:
         origin_string (string): the first few moves of a possible chess game in pgn format. However, in contrast to
         more general pgns, no branching is allowed here.
     Return:
-        list_of_sans (list): the elements of the list are strings. The strings are the same chess moves in SAN format
-        as the ones in origin_string.
+        list_of_sans (tuple): the elements of the tuple are strings. The strings are the same chess moves in SAN
+        format as the ones in origin_string. Callers that want to modify the sequence need to copy it into a list.
     """
     list_of_sans = []
     tokens = origin_string.split()
     for token in tokens:
         if not token[0].isnumeric():
             list_of_sans.append(token)
-    return list_of_sans
+    return tuple(list_of_sans)
 
+
+@functools.lru_cache(maxsize=8192)
 def translate_origin_string_into_list_of_uci(origin_string):
+    """ translates an origin string into the same sequence of moves in UCI format. The result is memoized for the most
+    recently used origin strings, so that an origin string that is used repeatedly is only replayed on a board once.
+
+    Args:
+        origin_string (string): a series of moves in SAN format starting from the initial board position
+    Returns:
+        (tuple) tuple of strings, each one a move in UCI format
+    """
     board = chess.Board()
     list_of_san_moves = build_list_of_san_moves_from_origin_string(origin_string)
     list_of_uci = []
@@ -111,20 +160,57 @@ def translate_origin_string_into_list_of_uci(origin_string):
         move = board.parse_san(san)
         list_of_uci.append(move.uci())
         board.push(move)
-    return list_of_uci
+    return tuple(list_of_uci)
+
 
+def translate_list_of_uci_into_list_of_san(uci_list, san_moves_of_uci_line=None):
+    """ translates a sequence of moves in uci format, starting from the initial position, into san format.
+    If a cache is passed, the translation of every beginning of the sequence is stored in it, so that for lines that
+    start with an already translated line only the remaining moves need to be translated. Replaying moves is much
+    cheaper than computing their san.
 
-def translate_list_of_uci_into_origin_string(uci_list):
+    Args:
+        uci_list: (iterable) a sequence of moves in uci format
+        san_moves_of_uci_line: (dict) optional. A cache that maps tuples of uci moves starting from the initial
+        position to the same moves in san format. The caller decides how long it is kept, e.g. while printing a batch
+        of lines that share their beginnings.
+    Returns: (tuple) the same moves in san format
+    """
+    if san_moves_of_uci_line is None:
+        san_moves_of_uci_line = {}
+    san_moves_of_uci_line.setdefault((), ())
+    uci_tuple = tuple(uci_list)
+    num_known = len(uci_tuple)
+    while uci_tuple[:num_known] not in san_moves_of_uci_line:
+        num_known -= 1
+    list_of_san = san_moves_of_uci_line[uci_tuple[:num_known]]
+    if num_known == len(uci_tuple):
+        return list_of_san
     board = chess.Board()
-    list_of_san = []
-    for uci_move in uci_list:
-        move = board.parse_uci(uci_move)
-        list_of_san.append(board.san(move))
+    for uci_move in uci_tuple[:num_known]:
+        board.push(chess.Move.from_uci(uci_move))
+    for i in range(num_known, len(uci_tuple)):
+        move = board.parse_uci(uci_tuple[i])
+        list_of_san = list_of_san + (board.san(move),)
         board.push(move)
-    return build_pgn_from_list_of_san_moves(list_of_san)
+        san_moves_of_uci_line[uci_tuple[:i + 1]] = list_of_san
+    return list_of_san
+
+
+def translate_list_of_uci_into_origin_string(uci_list, san_moves_of_uci_line=None):
+    return build_pgn_from_list_of_san_moves(translate_list_of_uci_into_list_of_san(uci_list, san_moves_of_uci_line))
 
 
-def successor_fen(fen_board, uci):
-    board = chess.Board(fen_board)
-    board.push(board.parse_uci(uci))
-    return relevant_fen_part(board.fen())
+def successor_board(board, move):
+    """ returns a new board with the position after executing move on board. board itself is not modified.
+    The new board is a copy of board without the move history, which is much cheaper than constructing a board from a
+    fen.
+
+    Args:
+        board: (chess.Board) the current board position
+        move: (chess.Move) a legal move in the current position
+    Returns: (chess.Board) the board position after the move
+    """
+    new_board = board.copy(stack=False)
+    new_board.push(move)
+    return new_board